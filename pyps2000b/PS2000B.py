@@ -4,7 +4,7 @@
 #
 # Supported features:
 # - read static device information (manufacturer, serial, device type ...)
-# - read dynamic device information (current, voltage)
+# - read dynamic device information (current, voltage, power)
 # - read/write remote control
 # - read/write output control
 #
@@ -17,35 +17,36 @@
 # [2] = "PS 2000B object list"
 #
 
+import contextlib
 import serial
 import struct
-import sys
-PY_3 = sys.version_info >= (3, 0)
+import time
 
 
 __author__ = "Sören Sprößig <ssproessig@gmail.com>"
 
-
-def as_string(raw_data):
-    """Converts the given raw bytes to a string (removes NULL)"""
-    return bytearray(raw_data[:-1])
+_F32_BE = struct.Struct(">f")
+_U16_BE = struct.Struct(">H")
+# status actual values, see [2] object 71: remote control, output, voltage %, current %
+_STATUS_BE = struct.Struct(">BBHH")
+# start delimiters for all transmission types (0..3) and expected data lengths (1..16), see [1] 2.4
+_START_DELIMITERS = tuple(bytes((transmission << 6) | 0b110000 | (length - 1) for length in range(1, 17))
+                          for transmission in range(4))
 
 
-def as_float(raw_data):
-    """Converts the given raw bytes to a float"""
-    f = struct.unpack_from(">f", bytearray(raw_data))[0]
-    return f
+def as_string(raw_data):
+    """Converts the given raw bytes (any buffer) to a string (removes NULL)"""
+    return str(raw_data[:-1], "ascii", "ignore").rstrip("\x00")
 
 
-def as_word(raw_data):
-    """Converts the given raw bytes to a word"""
-    w = struct.unpack_from(">H", bytearray(raw_data))[0]
-    return w
+def as_float(raw_data, offset=0):
+    """Converts the given raw bytes (any buffer) at offset to a float"""
+    return _F32_BE.unpack_from(raw_data, offset)[0]
 
 
-def _ord(x):
-    """Wrap ord() call as we only need it in Python 2"""
-    return x if PY_3 else ord(x)
+def as_word(raw_data, offset=0):
+    """Converts the given raw bytes (any buffer) at offset to a word"""
+    return _U16_BE.unpack_from(raw_data, offset)[0]
 
 
 # noinspection PyClassHasNoInit
@@ -94,36 +95,28 @@ class Telegram:
     """Base class of a PS2000B telegram - basically allows accessing the raw bytes and does checksum calculation"""
 
     def __init__(self):
-        self._bytes = []
-        self._checksum = []
+        self._bytes = bytearray()
+        self._checksum = bytes()
         self.checksum_ok = False
 
     def _calc_checksum(self):
-        cs = 0
-
-        for b in self._bytes:
-            cs += b
-
-        cs_high = (cs & 0xff00) >> 8
-        cs_low = cs & 0xff
-
-        return [cs_high, cs_low]
+        cs = sum(self._bytes) & 0xffff
+        return bytes([cs >> 8, cs & 0xff])
 
     @staticmethod
     def _get_start_delimiter(transmission, expected_data_length):
-        result = 0b00000000
-
-        if expected_data_length > 16:
+        if not 1 <= expected_data_length <= 16:
             raise Exception("only 4 bits for expected length can be used")
 
-        result |= (expected_data_length - 1)
-        result |= 0b10000
-        result |= 0b100000
-        result |= transmission << 6
-        return result
+        return _START_DELIMITERS[transmission][expected_data_length - 1]
 
     def get_byte_array(self):
-        return bytearray(self._bytes + self._checksum)
+        return bytes(self._bytes) + self._checksum
+
+    @staticmethod
+    def get_telegram_length(start_delimiter):
+        """Total telegram length: SD, DN, OBJ, data (length taken from SD) and 2 bytes checksum, see [1] 2.4"""
+        return 3 + (start_delimiter & 0b1111) + 1 + 2
 
 
 class FromPowerSupply(Telegram):
@@ -131,9 +124,9 @@ class FromPowerSupply(Telegram):
 
     def __init__(self, raw_data):
         Telegram.__init__(self)
-        data = [_ord(x) for x in raw_data]
+        data = bytearray(raw_data)
         self._bytes = data[0:-2]
-        self._checksum = data[len(data) - 2:len(data)]
+        self._checksum = data[-2:]
         self.checksum_ok = self._checksum == self._calc_checksum()
 
     def get_sd(self):
@@ -143,10 +136,19 @@ class FromPowerSupply(Telegram):
         return self._bytes[1]
 
     def get_object(self):
-        return self._bytes[3]
+        return self._bytes[2]
+
+    def is_answer_to(self, object_id):
+        """:returns True if this is a complete, valid answer for object_id (and not an error or a cut off one)"""
+        return self.checksum_ok and len(self._bytes) >= 3 and self.get_object() == object_id
+
+    def check_answer_to(self, object_id):
+        """Raises if this is no valid answer for object_id, see is_answer_to()"""
+        if not self.is_answer_to(object_id):
+            raise Exception("no valid answer for object %d received" % object_id)
 
     def get_data(self):
-        return self._bytes[3:len(self._bytes)]
+        return memoryview(self._bytes)[3:]
 
     # noinspection PyMethodMayBeStatic
     def get_error(self):
@@ -159,16 +161,40 @@ class ToPowerSupply(Telegram):
 
     def __init__(self, transmission, data, expected_data_length):
         Telegram.__init__(self)
-        self._bytes = []
         self._bytes.append(self._get_start_delimiter(transmission, expected_data_length))
         self._bytes.extend(data)
         self._checksum = self._calc_checksum()
         self.checksum_ok = True
 
 
+def _control_telegram(p1, p2):
+    return ToPowerSupply(0b11, [Constants.DEVICE_NODE, Objects.POWER_SUPPLY_CONTROL, p1, p2], 2).get_byte_array()
+
+
+# noinspection PyClassHasNoInit
+class ControlTelegrams:
+    """Control telegrams never change, so they are only built once"""
+    REMOTE_ON = _control_telegram(ControlParameters.SWITCH_MODE_CMD, ControlParameters.SWITCH_MODE_REMOTE)
+    REMOTE_OFF = _control_telegram(ControlParameters.SWITCH_MODE_CMD, ControlParameters.SWITCH_MODE_MANUAL)
+    OUTPUT_ON = _control_telegram(ControlParameters.SWITCH_POWER_OUTPUT_CMD, ControlParameters.SWITCH_POWER_OUTPUT_ON)
+    OUTPUT_OFF = _control_telegram(ControlParameters.SWITCH_POWER_OUTPUT_CMD, ControlParameters.SWITCH_POWER_OUTPUT_OFF)
+
+
 class DeviceInformation:
     """A class carrying all static device information read from the device"""
 
+    # objects taken from [2]: (attribute, object id, expected length, conversion)
+    # ratings are needed to calculate actual values, the identity is only needed when asked for
+    RATINGS = [("nominal_voltage", Objects.NOMINAL_VOLTAGE, 4, as_float),
+               ("nominal_current", Objects.NOMINAL_CURRENT, 4, as_float),
+               ("nominal_power", Objects.NOMINAL_POWER, 4, as_float)]
+    IDENTITY = [("device_type", Objects.DEVICE_TYPE, 16, as_string),
+                ("device_serial_no", Objects.DEVICE_SERIAL_NO, 16, as_string),
+                ("device_article_number", Objects.DEVICE_ARTICLE_NO, 16, as_string),
+                ("manufacturer", Objects.MANUFACTURER, 16, as_string),
+                ("software_version", Objects.SOFTWARE_VERSION, 16, as_string)]
+    OBJECTS = RATINGS + IDENTITY
+
     def __init__(self):
         self.device_type = ""
         self.device_serial_no = ""
@@ -186,63 +212,154 @@ class DeviceInformation:
                 self.software_version, self.device_article_number,
                 self.nominal_voltage, self.nominal_current, self.nominal_power)
 
+    @staticmethod
+    def get_read_requests(objects):
+        """:returns the (expected length, object id) pairs to read the given OBJECTS entries"""
+        return [(expected_length, object_id) for _, object_id, expected_length, _ in objects]
+
+    def update(self, objects, telegrams):
+        """Sets the attributes of the given OBJECTS entries from the telegrams answering their read requests"""
+        for (attribute, object_id, _, conversion), telegram in zip(objects, telegrams):
+            telegram.check_answer_to(object_id)
+            setattr(self, attribute, conversion(telegram.get_data()))
+
+    def get_actual_voltage(self, status):
+        """:returns the actual voltage in V for the given DeviceStatusInformation"""
+        return self.nominal_voltage * status.actual_voltage_percent / 100
+
+    def get_actual_current(self, status):
+        """:returns the actual current in A for the given DeviceStatusInformation"""
+        return self.nominal_current * status.actual_current_percent / 100
+
+    def get_actual_power(self, status):
+        """:returns the actual power in W for the given DeviceStatusInformation"""
+        return self.get_actual_voltage(status) * self.get_actual_current(status)
+
 
 class DeviceStatusInformation:
     """A class carrying all dynamic device status information"""
 
+    # (expected length, object id) taken from [2]
+    READ_REQUEST = (6, Objects.STATUS_ACTUAL_VALUES)
+
     def __init__(self, raw_data):
-        self.remote_control_active = raw_data[0] & 0b1
-        self.output_active = raw_data[1] & 0b1
-        self.actual_voltage_percent = float(as_word(raw_data[2:4])) / 256
-        self.actual_current_percent = float(as_word(raw_data[4:6])) / 256
+        remote_control, output, voltage, current = _STATUS_BE.unpack_from(raw_data)
+        self.remote_control_active = remote_control & 0b1
+        self.output_active = output & 0b1
+        self.actual_voltage_percent = voltage / 256.0
+        self.actual_current_percent = current / 256.0
 
     def __str__(self):
         return "Remote control active: %s, Output active: %s" % (self.remote_control_active, self.output_active)
 
+    @classmethod
+    def from_telegram(cls, telegram):
+        """Decodes the telegram answering the READ_REQUEST, raises if it is no valid answer"""
+        telegram.check_answer_to(Objects.STATUS_ACTUAL_VALUES)
+        return cls(telegram.get_data())
+
+
+def _open_serial(serial_port):
+    return serial.Serial(serial_port,
+                         baudrate=Constants.CONNECTION_BAUD_RATE,
+                         timeout=Constants.TIMEOUT_BETWEEN_COMMANDS * 2,
+                         parity=serial.PARITY_ODD,
+                         stopbits=Constants.CONNECTION_STOP_BITS,
+                         exclusive=True)
+
+
+class CommandSpacing:
+    """Keeps track of the last command written to a connection, [1] 3.7 requires a gap before the next one"""
+
+    def __init__(self):
+        self.__last_write = None
+
+    def get_delay(self):
+        """:returns the seconds to wait before the next command may be written"""
+        if self.__last_write is None:
+            return 0.0
+        return max(0.0, self.__last_write + Constants.TIMEOUT_BETWEEN_COMMANDS - time.monotonic())
+
+    def written(self):
+        self.__last_write = time.monotonic()
+
+
+def _write(connection, spacing, raw_bytes):
+    time.sleep(spacing.get_delay())
+    connection.write(raw_bytes)
+    spacing.written()
+
+
+def build_read_telegrams(requests):
+    """:returns the raw read request telegram for each (expected_length, object_id) pair"""
+    return [ToPowerSupply(0b01, [Constants.DEVICE_NODE, object_id], expected_length).get_byte_array()
+            for expected_length, object_id in requests]
+
+
+def _receive(connection):
+    """Reads exactly one telegram, its length is taken from the SD - no waiting for the timeout on short answers"""
+    start_delimiter = connection.read(1)
+    if not start_delimiter:
+        return FromPowerSupply(start_delimiter)
+
+    length = FromPowerSupply.get_telegram_length(start_delimiter[0])
+    return FromPowerSupply(start_delimiter + connection.read(length - 1))
+
 
 class PS2000B:
     """PS 2000 B main communication class"""
 
     def __init__(self, serial_port):
         self.__device_status_information = None
-        self.__serial = serial.Serial(serial_port,
-                                      baudrate=Constants.CONNECTION_BAUD_RATE,
-                                      timeout=Constants.TIMEOUT_BETWEEN_COMMANDS * 2,
-                                      parity=serial.PARITY_ODD,
-                                      stopbits=Constants.CONNECTION_STOP_BITS)
+        self.__serial = _open_serial(serial_port)
+        self.__spacing = CommandSpacing()
+
+        self.__device_information = DeviceInformation()
+        self.__identity_read = False
+        try:
+            self.__read_device_information(DeviceInformation.RATINGS)
+        except BaseException:
+            # the port is opened exclusively, do not keep it locked for a device we could not talk to
+            self.__serial.close()
+            raise
 
-        self.__device_information = self.__read_device_information()
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
     def is_open(self):
         return self.__serial.is_open
 
+    def close(self):
+        self.__serial.close()
+
     def get_device_information(self):
+        if not self.__identity_read:
+            self.__read_device_information(DeviceInformation.IDENTITY)
+            self.__identity_read = True
+
         return self.__device_information
 
-    def __read_device_information(self):
-        result = DeviceInformation()
+    def __read_device_information(self, objects):
+        telegrams = self.__pipeline_reads(DeviceInformation.get_read_requests(objects))
+        self.__device_information.update(objects, telegrams)
 
-        # taken from [2]
-        result.device_type = as_string(self.__read_device_data(16, Objects.DEVICE_TYPE).get_data())
-        result.device_serial_no = as_string(self.__read_device_data(16, Objects.DEVICE_SERIAL_NO).get_data())
-        result.nominal_voltage = as_float(self.__read_device_data(4, Objects.NOMINAL_VOLTAGE).get_data())
-        result.nominal_current = as_float(self.__read_device_data(4, Objects.NOMINAL_CURRENT).get_data())
-        result.nominal_power = as_float(self.__read_device_data(4, Objects.NOMINAL_POWER).get_data())
-        result.device_article_number = as_string(self.__read_device_data(16, Objects.DEVICE_ARTICLE_NO).get_data())
-        result.manufacturer = as_string(self.__read_device_data(16, Objects.MANUFACTURER).get_data())
-        result.software_version = as_string(self.__read_device_data(16, Objects.SOFTWARE_VERSION).get_data())
+    def __pipeline_reads(self, requests):
+        """Writes all (expected_length, object_id) read requests, then collects the answers in order
 
-        return result
+        The writes are still spaced as [1] 3.7 requires - the answers queue up in the serial input buffer meanwhile
+        and are drained afterwards without waiting for each round trip.
+        """
+        for telegram in build_read_telegrams(requests):
+            _write(self.__serial, self.__spacing, telegram)
 
-    def __read_device_data(self, expected_length, object_id):
-        telegram = ToPowerSupply(0b01, [Constants.DEVICE_NODE, object_id], expected_length)
-        result = self.__send_and_receive(telegram.get_byte_array())
-        return result
+        return [_receive(self.__serial) for _ in requests]
 
     def __send_and_receive(self, raw_bytes):
-        self.__serial.write(raw_bytes)
-        result = FromPowerSupply(self.__serial.read(Constants.MAX_LEN_IN_BYTES))
-        return result
+        _write(self.__serial, self.__spacing, raw_bytes)
+        return _receive(self.__serial)
 
     def get_device_status_information(self):
         """:returns DeviceStatusInformation"""
@@ -252,33 +369,67 @@ class PS2000B:
         return self.__device_status_information
 
     def update_device_information(self):
-        telegram = ToPowerSupply(0b01, [Constants.DEVICE_NODE, Objects.STATUS_ACTUAL_VALUES], 6)
-        device_information = self.__send_and_receive(telegram.get_byte_array())
-        self.__device_status_information = DeviceStatusInformation(device_information.get_data())
+        telegram, = build_read_telegrams([DeviceStatusInformation.READ_REQUEST])
+        self.__device_status_information = DeviceStatusInformation.from_telegram(self.__send_and_receive(telegram))
 
-    def __send_device_control(self, p1, p2):
-        telegram = ToPowerSupply(0b11, [Constants.DEVICE_NODE, Objects.POWER_SUPPLY_CONTROL, p1, p2], 2)
-        _ = self.__send_and_receive(telegram.get_byte_array())
-        self.update_device_information()
+    def __send_device_control(self, telegram):
+        _ = self.__send_and_receive(telegram)
+        # status is outdated now, re-read it lazily with the next get_device_status_information()
+        self.__device_status_information = None
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Groups several control calls - the device status is re-read only once when the block is left"""
+        yield self
+        if self.__device_status_information is None:
+            self.update_device_information()
 
     def enable_remote_control(self):
-        self.__send_device_control(ControlParameters.SWITCH_MODE_CMD, ControlParameters.SWITCH_MODE_REMOTE)
+        self.__send_device_control(ControlTelegrams.REMOTE_ON)
 
     def disable_remote_control(self):
-        self.__send_device_control(ControlParameters.SWITCH_MODE_CMD, ControlParameters.SWITCH_MODE_MANUAL)
+        self.__send_device_control(ControlTelegrams.REMOTE_OFF)
 
     def enable_output(self):
-        self.__send_device_control(ControlParameters.SWITCH_POWER_OUTPUT_CMD, ControlParameters.SWITCH_POWER_OUTPUT_ON)
+        self.__send_device_control(ControlTelegrams.OUTPUT_ON)
 
     def disable_output(self):
-        self.__send_device_control(ControlParameters.SWITCH_POWER_OUTPUT_CMD, ControlParameters.SWITCH_POWER_OUTPUT_OFF)
+        self.__send_device_control(ControlTelegrams.OUTPUT_OFF)
+
+    def wait_output(self, desired, timeout=2.0, poll=0.05):
+        """Polls the device status until the output is (in)active as desired, :returns False on timeout"""
+        deadline = time.monotonic() + timeout
+        while True:
+            self.update_device_information()
+            if bool(self.__device_status_information.output_active) == desired:
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(poll)
+
+    def __get_status(self, refresh):
+        if refresh:
+            self.update_device_information()
+        return self.get_device_status_information()
+
+    def get_voltage(self, refresh=True):
+        """:param refresh: re-read the device status, pass False to reuse the last status read (if there is one)"""
+        return self.__device_information.get_actual_voltage(self.__get_status(refresh))
+
+    def get_current(self, refresh=True):
+        """:param refresh: re-read the device status, pass False to reuse the last status read (if there is one)"""
+        return self.__device_information.get_actual_current(self.__get_status(refresh))
+
+    def get_power(self, refresh=True):
+        """Voltage and current are taken from the same status read"""
+        return self.__device_information.get_actual_power(self.__get_status(refresh))
 
-    def get_voltage(self):
-        self.update_device_information()
-        voltage = self.__device_information.nominal_voltage * self.__device_status_information.actual_voltage_percent
-        return voltage / 100
+def read_serial_number(serial_port):
+    """Reads only the serial number of the device at serial_port - a single telegram instead of opening a PS2000B"""
+    with _open_serial(serial_port) as connection:
+        telegram, = build_read_telegrams([(16, Objects.DEVICE_SERIAL_NO)])
+        _write(connection, CommandSpacing(), telegram)
 
-    def get_current(self):
-        self.update_device_information()
-        current = self.__device_information.nominal_current * self.__device_status_information.actual_current_percent
-        return current / 100
+        answer = _receive(connection)
+        answer.check_answer_to(Objects.DEVICE_SERIAL_NO)
+        return as_string(answer.get_data())
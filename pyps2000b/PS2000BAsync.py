@@ -0,0 +1,171 @@
+#!/usr/bin/python
+# coding=utf-8
+# asyncio based access to Elektro Automatik PS 2000 B devices via USB/serial
+#
+# Offers the same features as PS2000B, but all serial IO is awaited. This allows talking to several
+# power supplies concurrently, e.g. opening all of them in roughly the time needed for a single one.
+#
+# Needs pyserial-asyncio in addition to pyserial.
+#
+
+import asyncio
+import serial
+import serial_asyncio
+import time
+
+from pyps2000b.PS2000B import Constants, ControlTelegrams, FromPowerSupply, \
+    DeviceInformation, DeviceStatusInformation, CommandSpacing, build_read_telegrams
+
+
+__author__ = "Sören Sprößig <ssproessig@gmail.com>"
+
+
+class PS2000BAsync:
+    """PS 2000 B communication class for asyncio - use PS2000BAsync.open() to create it"""
+
+    def __init__(self, reader, writer):
+        self.__reader = reader
+        self.__writer = writer
+        # one exchange at a time - concurrent readers would steal each other's answers
+        self.__lock = asyncio.Lock()
+        self.__spacing = CommandSpacing()
+        self.__device_information = None
+        self.__device_status_information = None
+
+    @classmethod
+    async def open(cls, serial_port):
+        """Opens the device at serial_port and reads its static device information"""
+        reader, writer = await serial_asyncio.open_serial_connection(url=serial_port,
+                                                                     baudrate=Constants.CONNECTION_BAUD_RATE,
+                                                                     parity=serial.PARITY_ODD,
+                                                                     stopbits=Constants.CONNECTION_STOP_BITS,
+                                                                     exclusive=True)
+        device = cls(reader, writer)
+        try:
+            device.__device_information = await device.__read_device_information()
+        except BaseException:
+            # the port is opened exclusively, do not keep it locked for a device we could not talk to
+            device.close()
+            raise
+
+        return device
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.__writer.close()
+
+    def get_device_information(self):
+        return self.__device_information
+
+    async def __read_device_information(self):
+        result = DeviceInformation()
+        objects = DeviceInformation.OBJECTS
+        result.update(objects, await self.__pipeline_reads(DeviceInformation.get_read_requests(objects)))
+        return result
+
+    async def __pipeline_reads(self, requests):
+        """Writes all (expected_length, object_id) read requests spaced as [1] 3.7 requires, then reads the answers"""
+        async with self.__lock:
+            for telegram in build_read_telegrams(requests):
+                await self.__write(telegram)
+
+            # no await inside a list comprehension, that needs Python 3.6
+            answers = []
+            for _ in requests:
+                answers.append(await self.__receive())
+            return answers
+
+    async def __write(self, raw_bytes):
+        """Writes a command, keeping the gap to the previous one that [1] 3.7 requires"""
+        await asyncio.sleep(self.__spacing.get_delay())
+        self.__writer.write(raw_bytes)
+        self.__spacing.written()
+
+    async def __receive(self):
+        """Reads exactly one telegram, raises asyncio.TimeoutError if the device does not answer"""
+        timeout = Constants.TIMEOUT_BETWEEN_COMMANDS * 2
+        start_delimiter = await asyncio.wait_for(self.__reader.readexactly(1), timeout)
+        length = FromPowerSupply.get_telegram_length(start_delimiter[0])
+        return FromPowerSupply(start_delimiter + await asyncio.wait_for(self.__reader.readexactly(length - 1), timeout))
+
+    async def __send_and_receive(self, raw_bytes):
+        async with self.__lock:
+            await self.__write(raw_bytes)
+            return await self.__receive()
+
+    async def get_device_status_information(self):
+        """:returns DeviceStatusInformation"""
+        if self.__device_status_information is None:
+            await self.update_device_information()
+
+        return self.__device_status_information
+
+    async def update_device_information(self):
+        telegram, = build_read_telegrams([DeviceStatusInformation.READ_REQUEST])
+        answer = await self.__send_and_receive(telegram)
+        self.__device_status_information = DeviceStatusInformation.from_telegram(answer)
+
+    async def __send_device_control(self, telegram):
+        _ = await self.__send_and_receive(telegram)
+        self.__device_status_information = None
+
+    async def enable_remote_control(self):
+        await self.__send_device_control(ControlTelegrams.REMOTE_ON)
+
+    async def disable_remote_control(self):
+        await self.__send_device_control(ControlTelegrams.REMOTE_OFF)
+
+    async def enable_output(self):
+        await self.__send_device_control(ControlTelegrams.OUTPUT_ON)
+
+    async def disable_output(self):
+        await self.__send_device_control(ControlTelegrams.OUTPUT_OFF)
+
+    async def wait_output(self, desired, timeout=2.0, poll=0.05):
+        """Polls the device status until the output is (in)active as desired, :returns False on timeout"""
+        deadline = time.monotonic() + timeout
+        while True:
+            await self.update_device_information()
+            if bool(self.__device_status_information.output_active) == desired:
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(poll)
+
+    async def __get_status(self, refresh):
+        if refresh:
+            await self.update_device_information()
+        return await self.get_device_status_information()
+
+    async def get_voltage(self, refresh=True):
+        """:param refresh: re-read the device status, pass False to reuse the last status read (if there is one)"""
+        return self.__device_information.get_actual_voltage(await self.__get_status(refresh))
+
+    async def get_current(self, refresh=True):
+        """:param refresh: re-read the device status, pass False to reuse the last status read (if there is one)"""
+        return self.__device_information.get_actual_current(await self.__get_status(refresh))
+
+    async def get_power(self, refresh=True):
+        """Voltage and current are taken from the same status read"""
+        return self.__device_information.get_actual_power(await self.__get_status(refresh))
+
+async def open_all(serial_ports):
+    """Opens all given serial ports concurrently, :returns the PS2000BAsync devices in the same order
+
+    If any port fails to open, the devices opened successfully are closed again and the first error is raised.
+    """
+    results = await asyncio.gather(*[PS2000BAsync.open(serial_port) for serial_port in serial_ports],
+                                   return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        for result in results:
+            if not isinstance(result, BaseException):
+                result.close()
+        raise errors[0]
+
+    return results